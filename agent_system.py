@@ -1,14 +1,66 @@
 """Multi-Agent System using LangGraph for Question Generation and Evaluation"""
 import os
-from typing import List, Dict, Any, TypedDict
+import asyncio
+import hashlib
+from typing import List, Dict, Any, Optional, TypedDict
+import numpy as np
+from langchain_core.embeddings import Embeddings
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.messages import HumanMessage, SystemMessage, AIMessage
+from langchain_core.runnables import RunnableConfig
 from langgraph.graph import StateGraph, END
 import logging
 import json
+import orjson
+
+from semantic_cache import SemanticLLMCache
 
 logger = logging.getLogger(__name__)
 
+# Retrieved-document context budget (characters) for the generator prompt
+MAX_CONTEXT_CHARS = 3000
+
+# System prompt is static so it forms an identical prefix across calls (Gemini implicit prefix caching)
+GENERATOR_SYSTEM_PROMPT = """You are an expert educational content creator and assessment evaluator. Generate 5 high-quality Multiple Choice Questions (MCQs), then critically review each one you wrote.
+
+For each question provide:
+- "question", "options" (A-D), "correct_answer" and "explanation"
+- "quality_score": 1-10 score for clarity, accuracy and quality of distractors
+- "evaluator_feedback": Brief feedback
+- "approved": true/false
+
+Return ONLY the JSON array."""
+
+# Gemini structured output schema: guarantees a parseable JSON array of scored MCQs
+QUESTION_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "question": {"type": "string"},
+            "options": {
+                "type": "object",
+                "properties": {
+                    "A": {"type": "string"},
+                    "B": {"type": "string"},
+                    "C": {"type": "string"},
+                    "D": {"type": "string"}
+                },
+                "required": ["A", "B", "C", "D"]
+            },
+            "correct_answer": {"type": "string", "enum": ["A", "B", "C", "D"]},
+            "explanation": {"type": "string"},
+            "quality_score": {"type": "integer"},
+            "evaluator_feedback": {"type": "string"},
+            "approved": {"type": "boolean"}
+        },
+        "required": [
+            "question", "options", "correct_answer", "explanation",
+            "quality_score", "evaluator_feedback", "approved"
+        ]
+    }
+}
+
 class AgentState(TypedDict):
     """State for the multi-agent workflow"""
     query: str
@@ -19,7 +71,18 @@ class AgentState(TypedDict):
     evaluation_feedback: str
     iteration: int
 
+async def _generator_node(state: AgentState, config: RunnableConfig) -> AgentState:
+    """Graph node: dispatch to the invoking instance's generator agent"""
+    return await config["configurable"]["agent_system"].question_generator_agent(state)
+
+def _finalizer_node(state: AgentState, config: RunnableConfig) -> AgentState:
+    """Graph node: dispatch to the invoking instance's finalizer agent"""
+    return config["configurable"]["agent_system"].finalizer_agent(state)
+
 class MultiAgentQuestionSystem:
+    # Compiled workflow shared by all instances (graph structure is constant)
+    _workflow = None
+    
     def __init__(self):
         self.google_api_key = os.getenv('GOOGLE_API_KEY')
         
@@ -27,157 +90,129 @@ class MultiAgentQuestionSystem:
         self.llm = ChatGoogleGenerativeAI(
             model="gemini-2.5-flash",
             google_api_key=self.google_api_key,
-            temperature=0.7
+            temperature=0.7,
+            response_mime_type="application/json",
+            response_schema=QUESTION_SCHEMA
         )
         
-        # Build the workflow graph
-        self.workflow = self._build_workflow()
+        # Number of parallel generations merged per request (self-consistency mode)
+        self.num_generations = max(1, int(os.getenv('GENERATOR_SAMPLES', '1')))
+        
+        # Semantic cache for LLM responses; query similarity needs the (normalized) embedding model,
+        # which the server attaches once the RAG service has loaded it
+        self.embeddings: Optional[Embeddings] = None
+        cache_path = os.getenv('LLM_CACHE_PATH', './llm_cache.sqlite3')
+        cache_ttl = float(os.getenv('LLM_CACHE_TTL_SECONDS', '3600'))
+        self.generator_cache = SemanticLLMCache("generator", ttl_seconds=cache_ttl, db_path=cache_path)
+        
+        # The pipeline is strictly linear, so agents are chained directly by default.
+        # USE_LANGGRAPH=true runs it through the compiled LangGraph workflow instead
+        # (shared across instances) for debugging or future branching.
+        self.use_langgraph = os.getenv('USE_LANGGRAPH', 'false').lower() == 'true'
+        self.workflow = type(self)._get_workflow() if self.use_langgraph else None
     
-    def _build_workflow(self) -> StateGraph:
-        """Build LangGraph workflow with two agents"""
+    @classmethod
+    def _get_workflow(cls):
+        """Return the compiled workflow, building it on first use"""
+        if cls._workflow is None:
+            cls._workflow = cls._build_workflow()
+        return cls._workflow
+    
+    @staticmethod
+    def _build_workflow():
+        """Build LangGraph workflow: combined generator/evaluator, then finalizer.
+        
+        Nodes are instance-independent; the running instance is passed via
+        config["configurable"]["agent_system"].
+        """
         workflow = StateGraph(AgentState)
         
         # Add nodes (agents)
-        workflow.add_node("generator", self.question_generator_agent)
-        workflow.add_node("evaluator", self.question_evaluator_agent)
-        workflow.add_node("finalizer", self.finalizer_agent)
+        workflow.add_node("generator", _generator_node)
+        workflow.add_node("finalizer", _finalizer_node)
         
         # Define edges
         workflow.set_entry_point("generator")
-        workflow.add_edge("generator", "evaluator")
-        workflow.add_edge("evaluator", "finalizer")
+        workflow.add_edge("generator", "finalizer")
         workflow.add_edge("finalizer", END)
         
         return workflow.compile()
     
-    def question_generator_agent(self, state: AgentState) -> AgentState:
-        """Agent 1: Generate MCQ questions from retrieved content"""
+    @staticmethod
+    def _dedupe_questions(batches: List[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """Merge question batches, dropping repeats of the same question text"""
+        seen = set()
+        merged = []
+        for batch in batches:
+            for q in batch:
+                key = " ".join(str(q.get('question', '')).lower().split())
+                if key in seen:
+                    continue
+                seen.add(key)
+                merged.append(q)
+        return merged
+    
+    async def question_generator_agent(self, state: AgentState) -> AgentState:
+        """Agent 1: Generate and self-evaluate MCQ questions from retrieved content in one call"""
         logger.info("Running Question Generator Agent...")
         
-        system_prompt = """You are an expert educational content creator. Generate 5 high-quality Multiple Choice Questions (MCQs).
-
-STRICT JSON FORMAT - Your ENTIRE response must be ONLY valid JSON, nothing else:
-[
-  {
-    "question": "Question text?",
-    "options": {
-      "A": "Option A",
-      "B": "Option B",
-      "C": "Option C",
-      "D": "Option D"
-    },
-    "correct_answer": "A",
-    "explanation": "Why this is correct"
-  }
-]
-
-CRITICAL: Return ONLY the JSON array. No markdown, no code blocks, no explanations."""
-        
         user_prompt = f"""Generate 5 MCQ questions from this content about: {state['query']}
 
 CONTENT:
-{state['retrieved_docs'][:3000]}
-
-Return ONLY valid JSON array."""
+{state['retrieved_docs'][:MAX_CONTEXT_CHARS]}"""
+        
+        messages = [
+            SystemMessage(content=GENERATOR_SYSTEM_PROMPT),
+            HumanMessage(content=user_prompt)
+        ]
         
         try:
-            messages = [
-                SystemMessage(content=system_prompt),
-                HumanMessage(content=user_prompt)
-            ]
-            
-            response = self.llm.invoke(messages)
-            response_text = response.content.strip()
-            
-            # Clean up the response
-            # Remove markdown code blocks
-            if "```json" in response_text:
-                response_text = response_text.split("```json")[1].split("```")[0].strip()
-            elif "```" in response_text:
-                response_text = response_text.split("```")[1].split("```")[0].strip()
+            # Check the semantic cache before calling Gemini
+            docs_hash = hashlib.sha256(state['retrieved_docs'][:MAX_CONTEXT_CHARS].encode()).hexdigest()
+            query_embedding = None
+            if self.embeddings is not None:
+                # Model call is CPU-bound; keep it off the event loop
+                query_embedding = np.asarray(
+                    await asyncio.to_thread(self.embeddings.embed_query, state['query']),
+                    dtype=np.float32
+                )
             
-            # Remove any text before the first [
-            if "[" in response_text:
-                response_text = response_text[response_text.index("["):]
+            cached = await asyncio.to_thread(self.generator_cache.lookup, docs_hash, query_embedding)
+            if cached is not None:
+                state['raw_questions'] = state['evaluated_questions'] = json.loads(cached)
+                logger.info(f"Generator cache hit: reusing {len(state['raw_questions'])} questions")
+                return state
             
-            # Remove any text after the last ]
-            if "]" in response_text:
-                response_text = response_text[:response_text.rindex("]")+1]
+            # Run all generations concurrently; a single sample is the default
+            responses = await asyncio.gather(
+                *(self.llm.ainvoke(messages) for _ in range(self.num_generations)),
+                return_exceptions=True
+            )
             
-            logger.info(f"Cleaned response: {response_text[:200]}...")
+            batches = []
+            for response in responses:
+                if isinstance(response, Exception):
+                    logger.error(f"Error in question generator: {response}")
+                    continue
+                try:
+                    batches.append(orjson.loads(response.content))
+                except (TypeError, ValueError) as e:
+                    # Covers orjson.JSONDecodeError and non-str response content; keep the other batches
+                    logger.error(f"JSON parsing error in question generator: {e}")
+                    logger.error(f"Response text: {str(response.content)[:500]}")
             
-            questions = json.loads(response_text)
+            questions = self._dedupe_questions(batches)
+            if questions:
+                # SQLite insert + commit is blocking I/O; keep it off the event loop
+                await asyncio.to_thread(self.generator_cache.store, docs_hash, json.dumps(questions), query_embedding)
             
-            state['raw_questions'] = questions
-            logger.info(f"Generated {len(questions)} questions")
+            # Questions already carry their evaluation fields
+            state['raw_questions'] = state['evaluated_questions'] = questions
+            logger.info(f"Generated and evaluated {len(questions)} questions")
             
-        except json.JSONDecodeError as e:
-            logger.error(f"JSON parsing error in question generator: {e}")
-            logger.error(f"Response text: {response_text[:500]}")
-            state['raw_questions'] = []
         except Exception as e:
             logger.error(f"Error in question generator: {e}")
-            state['raw_questions'] = []
-        
-        return state
-    
-    def question_evaluator_agent(self, state: AgentState) -> AgentState:
-        """Agent 2: Evaluate and improve generated questions"""
-        logger.info("Running Question Evaluator Agent...")
-        
-        # If no questions generated, skip evaluation
-        if not state['raw_questions']:
-            logger.warning("No questions to evaluate")
-            state['evaluated_questions'] = []
-            return state
-        
-        system_prompt = """You are an educational assessment evaluator. Review the MCQ questions and add:
-- "quality_score": 1-10 score
-- "evaluator_feedback": Brief feedback
-- "approved": true/false
-
-Return the same JSON structure with these fields added. Return ONLY valid JSON."""
-        
-        user_prompt = f"""Evaluate these questions:
-
-{json.dumps(state['raw_questions'], indent=2)}
-
-Return ONLY valid JSON with quality_score, evaluator_feedback, and approved fields added."""
-        
-        try:
-            messages = [
-                SystemMessage(content=system_prompt),
-                HumanMessage(content=user_prompt)
-            ]
-            
-            response = self.llm.invoke(messages)
-            response_text = response.content.strip()
-            
-            # Clean response
-            if "```json" in response_text:
-                response_text = response_text.split("```json")[1].split("```")[0].strip()
-            elif "```" in response_text:
-                response_text = response_text.split("```")[1].split("```")[0].strip()
-            
-            if "[" in response_text:
-                response_text = response_text[response_text.index("["):]
-            if "]" in response_text:
-                response_text = response_text[:response_text.rindex("]")+1]
-            
-            evaluated_questions = json.loads(response_text)
-            state['evaluated_questions'] = evaluated_questions
-            logger.info(f"Evaluated {len(evaluated_questions)} questions")
-            
-        except json.JSONDecodeError as e:
-            logger.error(f"JSON parsing error in evaluator: {e}")
-            # Use raw questions with default scores
-            state['evaluated_questions'] = [
-                {**q, "quality_score": 8, "evaluator_feedback": "Auto-approved", "approved": True}
-                for q in state['raw_questions']
-            ]
-        except Exception as e:
-            logger.error(f"Error in question evaluator: {e}")
-            state['evaluated_questions'] = state['raw_questions']
+            state['raw_questions'] = state['evaluated_questions'] = []
         
         return state
     
@@ -197,15 +232,20 @@ Return ONLY valid JSON with quality_score, evaluator_feedback, and approved fiel
         
         return state
     
-    def generate_questions(self, query: str, retrieved_docs: List[Any]) -> List[Dict[str, Any]]:
+    async def generate_questions(self, query: str, retrieved_docs: List[Any]) -> List[Dict[str, Any]]:
         """Run the complete multi-agent workflow"""
         logger.info("Starting multi-agent question generation workflow...")
         
-        # Prepare retrieved docs as text
-        docs_text = "\n\n".join([
-            f"Document {i+1}:\n{doc.page_content}" 
-            for i, doc in enumerate(retrieved_docs)
-        ])
+        # Prepare retrieved docs as text, truncated to the prompt budget while joining
+        parts, used = [], 0
+        for i, doc in enumerate(retrieved_docs):
+            separator = "\n\n" if i else ""
+            piece = f"{separator}Document {i+1}:\n{doc.page_content}"
+            parts.append(piece[:MAX_CONTEXT_CHARS - used])
+            used += len(parts[-1])
+            if used >= MAX_CONTEXT_CHARS:
+                break
+        docs_text = "".join(parts)
         
         # Initial state
         initial_state = {
@@ -220,7 +260,14 @@ Return ONLY valid JSON with quality_score, evaluator_feedback, and approved fiel
         
         # Run workflow
         try:
-            final_state = self.workflow.invoke(initial_state)
+            if self.use_langgraph:
+                final_state = await self.workflow.ainvoke(
+                    initial_state,
+                    config={"configurable": {"agent_system": self}}
+                )
+            else:
+                state = await self.question_generator_agent(initial_state)
+                final_state = self.finalizer_agent(state)
             return final_state['final_questions']
         except Exception as e:
             logger.error(f"Error in multi-agent workflow: {e}")
@@ -0,0 +1,18 @@
+"""PDF page extraction run in worker processes.
+
+Kept separate from rag_service so unpickling this function in a spawned
+worker doesn't import the embedding model, Chroma or LangChain. Spawn still
+re-imports the parent's __main__ module in each worker: under
+`uvicorn server:app` that is uvicorn's entry point, but under
+`python server.py` every worker imports server.py and its dependencies.
+"""
+from typing import List
+from pypdf import PdfReader
+
+def extract_page_range(pdf_path: str, start: int, stop: int) -> List[str]:
+    """Extract text for pages [start, stop) in a worker process.
+
+    PdfReader objects don't pickle well, so each worker reopens the file.
+    """
+    reader = PdfReader(pdf_path, strict=False)
+    return [reader.pages[i].extract_text() for i in range(start, stop)]
@@ -1,6 +1,10 @@
 """RAG Service for PDF processing and vector storage using ChromaDB"""
 import os
-from typing import List, Dict, Any
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Dict, Any, Optional
 from pathlib import Path
 import chromadb
 from chromadb.config import Settings
@@ -11,9 +15,22 @@ from langchain_core.documents import Document
 from pypdf import PdfReader
 import logging
 import re
+import uuid
+
+from pdf_extraction import extract_page_range
 
 logger = logging.getLogger(__name__)
 
+# Below this many pages, worker process startup costs more than it saves
+PARALLEL_EXTRACTION_MIN_PAGES = 16
+
+# Upper bound on extraction worker processes (one pool shared by all uploads)
+MAX_EXTRACTION_PROCESSES = 4
+
+def _cpu_budget() -> int:
+    """CPUs available to this process when uvicorn runs WEB_CONCURRENCY workers"""
+    return max(1, (os.cpu_count() or 1) // max(1, int(os.getenv('WEB_CONCURRENCY', '1'))))
+
 class RAGService:
     def __init__(self):
         self.google_api_key = os.getenv('GOOGLE_API_KEY')
@@ -21,17 +38,24 @@ class RAGService:
         
         # Initialize embeddings - using local HuggingFace model to avoid API quota issues
         logger.info("Initializing HuggingFace embeddings (local model)...")
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name="all-MiniLM-L6-v2",  # Fast, efficient local model
-            model_kwargs={'device': 'cpu'},
-            encode_kwargs={'normalize_embeddings': True}
-        )
+        self.embeddings = self._initialize_embeddings()
         logger.info("Embeddings initialized successfully")
         
+        # Long-lived PDF extraction pool, started on first large PDF
+        self._extraction_workers = min(_cpu_budget(), MAX_EXTRACTION_PROCESSES)
+        self._extraction_pool = None
+        self._extraction_pool_lock = threading.Lock()
+        
         # Initialize ChromaDB
         self.vectorstore = None
         self._initialize_vectorstore()
         
+        # Bumped whenever the collection changes; used to key response caches
+        self._collection_rev = 0
+        
+        # Heading heuristic for TOC extraction (compiled once, matched per line)
+        self._toc_re = re.compile(r'^(?:\d+\.\d*\s+(?-i:[A-Z])|Chapter\s+\d+|Section\s+\d+)', re.IGNORECASE)
+        
         # Text splitter for chunking
         self.text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=1000,
@@ -40,49 +64,133 @@ class RAGService:
             separators=["\n\n", "\n", " ", ""]
         )
     
+    def _initialize_embeddings(self) -> HuggingFaceEmbeddings:
+        """Load MiniLM, preferring the int8-quantized ONNX Runtime export over FP32 PyTorch"""
+        model_kwargs = {'device': 'cpu'}
+        encode_kwargs = {'normalize_embeddings': True, 'batch_size': 64}
+        
+        if os.getenv('EMBEDDING_BACKEND', 'onnx') == 'onnx':
+            try:
+                # The ONNX backend needs optimum[onnxruntime]; fall back to PyTorch if it's missing
+                import onnxruntime as ort
+                import optimum.onnxruntime  # noqa: F401
+            except ImportError as e:
+                logger.warning(f"ONNX embeddings unavailable, falling back to PyTorch: {e}")
+            else:
+                session_options = ort.SessionOptions()
+                session_options.intra_op_num_threads = _cpu_budget()
+                return HuggingFaceEmbeddings(
+                    model_name="all-MiniLM-L6-v2",
+                    model_kwargs={
+                        **model_kwargs,
+                        'backend': 'onnx',
+                        'model_kwargs': {
+                            # Quantized exports ship with the sentence-transformers model repo
+                            'file_name': os.getenv('EMBEDDING_ONNX_FILE', 'onnx/model_quint8_avx2.onnx'),
+                            'provider': 'CPUExecutionProvider',
+                            'session_options': session_options
+                        }
+                    },
+                    encode_kwargs=encode_kwargs
+                )
+        
+        return HuggingFaceEmbeddings(
+            model_name="all-MiniLM-L6-v2",  # Fast, efficient local model
+            model_kwargs=model_kwargs,
+            encode_kwargs=encode_kwargs
+        )
+    
     def _initialize_vectorstore(self):
         """Initialize ChromaDB vector store"""
         try:
             self.vectorstore = Chroma(
                 collection_name="pdf_documents",
                 embedding_function=self.embeddings,
-                persist_directory=self.chroma_persist_dir
+                persist_directory=self.chroma_persist_dir,
+                # HNSW index settings only apply when the collection is first created
+                collection_metadata={"hnsw:space": "cosine", "hnsw:construction_ef": 200, "hnsw:M": 32}
             )
             logger.info("Vector store initialized successfully")
         except Exception as e:
             logger.error(f"Error initializing vector store: {e}")
             raise
     
+    def _get_extraction_pool(self) -> ProcessPoolExecutor:
+        """Return the shared PDF extraction pool, starting it on first use"""
+        with self._extraction_pool_lock:
+            if self._extraction_pool is None:
+                # spawn, not fork: this process runs model/Chroma threads and extraction is
+                # called from a worker thread, where forking can deadlock. Spawned workers
+                # re-import __main__ (all of server.py when started via `python server.py`).
+                self._extraction_pool = ProcessPoolExecutor(
+                    max_workers=self._extraction_workers,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._extraction_pool
+    
+    def _discard_extraction_pool(self, pool: ProcessPoolExecutor):
+        """Drop a broken pool so the next large PDF starts a fresh one"""
+        with self._extraction_pool_lock:
+            if self._extraction_pool is pool:
+                self._extraction_pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+    
+    def close(self):
+        """Shut down the PDF extraction worker pool"""
+        with self._extraction_pool_lock:
+            if self._extraction_pool is not None:
+                self._extraction_pool.shutdown()
+                self._extraction_pool = None
+    
     def extract_text_from_pdf(self, pdf_path: str) -> tuple[str, List[str]]:
         """Extract text and table of contents from PDF"""
         try:
-            reader = PdfReader(pdf_path)
-            full_text = ""
+            reader = PdfReader(pdf_path, strict=False)
+            num_pages = len(reader.pages)
+            page_parts = []
             toc = []
             
-            # Extract text from all pages
-            for page_num, page in enumerate(reader.pages, 1):
-                text = page.extract_text()
-                full_text += f"\n--- Page {page_num} ---\n{text}"
+            # Extract page text, fanning contiguous page ranges out across processes for large PDFs
+            workers = self._extraction_workers
+            if workers > 1 and num_pages >= PARALLEL_EXTRACTION_MIN_PAGES:
+                step = -(-num_pages // (workers * 4))
+                starts = range(0, num_pages, step)
+                stops = [min(start + step, num_pages) for start in starts]
+                executor = self._get_extraction_pool()
+                try:
+                    page_texts = [
+                        text
+                        for texts in executor.map(extract_page_range, [pdf_path] * len(starts), starts, stops)
+                        for text in texts
+                    ]
+                except BrokenProcessPool:
+                    # A worker died; don't let the dead pool fail every later ingest
+                    self._discard_extraction_pool(executor)
+                    raise
+            else:
+                page_texts = [page.extract_text() for page in reader.pages]
+            
+            for page_num, text in enumerate(page_texts, 1):
+                page_parts.append(f"\n--- Page {page_num} ---\n{text}")
                 
                 # Try to identify headings/sections (simple heuristic)
                 lines = text.split('\n')
                 for line in lines:
                     line = line.strip()
                     # Detect headings (lines that are short, capitalized, or numbered)
-                    if line and (
-                        (len(line) < 100 and line.isupper()) or
-                        re.match(r'^\d+\.\d*\s+[A-Z]', line) or
-                        re.match(r'^Chapter\s+\d+', line, re.IGNORECASE) or
-                        re.match(r'^Section\s+\d+', line, re.IGNORECASE)
-                    ):
+                    if not line or len(line) >= 100:
+                        continue
+                    if line.isupper() or self._toc_re.match(line):
                         toc.append(f"Page {page_num}: {line}")
             
+            # Join once at the end: linear time regardless of CPython's in-place concat optimization
+            full_text = "".join(page_parts)
+            
             # If no TOC detected, create generic one
             if not toc:
-                toc = [f"Page {i+1}" for i in range(len(reader.pages))]
+                toc = [f"Page {i+1}" for i in range(num_pages)]
             
-            logger.info(f"Extracted {len(reader.pages)} pages from PDF")
+            logger.info(f"Extracted {num_pages} pages from PDF")
             return full_text, toc
             
         except Exception as e:
@@ -98,24 +206,32 @@ class RAGService:
             # Split into chunks
             chunks = self.text_splitter.split_text(full_text)
             
-            # Create documents with metadata
-            documents = []
-            for i, chunk in enumerate(chunks):
-                doc_metadata = {
+            # Build metadata for each chunk
+            metadatas = [
+                {
                     "chunk_id": i,
                     "source": pdf_path,
                     **(metadata or {})
                 }
-                documents.append(Document(page_content=chunk, metadata=doc_metadata))
+                for i in range(len(chunks))
+            ]
             
-            # Add to vector store
-            self.vectorstore.add_documents(documents)
+            # Embed all chunks in one batched call, then insert directly so Chroma doesn't re-embed
+            if chunks:
+                embeddings = self.embeddings.embed_documents(chunks)
+                self.vectorstore._collection.add(
+                    ids=[str(uuid.uuid4()) for _ in chunks],
+                    embeddings=embeddings,
+                    documents=chunks,
+                    metadatas=metadatas
+                )
             
-            logger.info(f"Ingested {len(documents)} chunks into vector store")
+            self._collection_rev += 1
+            logger.info(f"Ingested {len(chunks)} chunks into vector store")
             
             return {
                 "status": "success",
-                "chunks_processed": len(documents),
+                "chunks_processed": len(chunks),
                 "table_of_contents": toc
             }
             
@@ -123,10 +239,25 @@ class RAGService:
             logger.error(f"Error ingesting PDF: {e}")
             raise
     
-    def retrieve_relevant_docs(self, query: str, k: int = 5) -> List[Document]:
-        """Retrieve relevant documents for a query"""
+    @property
+    def collection_revision(self) -> str:
+        """Revision of the vector store contents.
+        
+        Includes the chunk count so that ingests done by other worker processes
+        (which only bump their own counter) still change the revision.
+        """
+        return f"{self._collection_rev}-{self.vectorstore._collection.count()}"
+    
+    def retrieve_relevant_docs(self, query: str, k: int = 5, filename: Optional[str] = None) -> List[Document]:
+        """Retrieve relevant, diverse documents for a query (MMR), optionally limited to one PDF"""
         try:
-            results = self.vectorstore.similarity_search(query, k=k)
+            results = self.vectorstore.max_marginal_relevance_search(
+                query,
+                k=k,
+                fetch_k=max(20, k * 4),
+                lambda_mult=0.5,
+                filter={"filename": filename} if filename else None
+            )
             logger.info(f"Retrieved {len(results)} relevant documents for query")
             return results
         except Exception as e:
@@ -141,6 +272,7 @@ class RAGService:
                 import shutil
                 shutil.rmtree(self.chroma_persist_dir)
             self._initialize_vectorstore()
+            self._collection_rev += 1
             logger.info("Vector store cleared")
         except Exception as e:
             logger.error(f"Error clearing vector store: {e}")
@@ -0,0 +1,138 @@
+"""Semantic cache for LLM responses backed by an in-memory LRU and SQLite"""
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
+
+class SemanticLLMCache:
+    """Reuse LLM responses for semantically similar queries over the same context.
+
+    Entries are keyed by a context hash (exact match) and an optional normalized
+    query embedding (cosine similarity >= threshold). Entries expire after
+    ``ttl_seconds`` and the least recently used ones are evicted past ``max_entries``.
+    """
+
+    def __init__(
+        self,
+        namespace: str,
+        similarity_threshold: float = 0.92,
+        max_entries: int = 256,
+        ttl_seconds: float = 3600,
+        db_path: Optional[str] = None
+    ):
+        self.namespace = namespace
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+
+        # entry_id -> (embedding, context_hash, response, created_at)
+        self._entries: "OrderedDict[int, Tuple[Optional[np.ndarray], str, str, float]]" = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+        self._conn = None
+        if db_path:
+            self._initialize_db(db_path)
+
+    def _initialize_db(self, db_path: str):
+        """Open the SQLite persistence layer and load non-expired entries"""
+        try:
+            self._conn = sqlite3.connect(db_path, check_same_thread=False)
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS llm_cache (
+                    namespace TEXT NOT NULL,
+                    context_hash TEXT NOT NULL,
+                    embedding BLOB,
+                    response TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )"""
+            )
+            cutoff = time.time() - self.ttl_seconds
+            self._conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (cutoff,))
+            self._conn.commit()
+
+            rows = self._conn.execute(
+                "SELECT embedding, context_hash, response, created_at FROM llm_cache "
+                "WHERE namespace = ? ORDER BY created_at DESC LIMIT ?",
+                (self.namespace, self.max_entries)
+            ).fetchall()
+            for blob, context_hash, response, created_at in reversed(rows):
+                embedding = np.frombuffer(blob, dtype=np.float32) if blob is not None else None
+                self._entries[self._next_id] = (embedding, context_hash, response, created_at)
+                self._next_id += 1
+            logger.info(f"Loaded {len(rows)} cached '{self.namespace}' responses from {db_path}")
+        except sqlite3.Error as e:
+            logger.error(f"Error opening semantic cache database: {e}")
+            self._conn = None
+
+    def lookup(self, context_hash: str, embedding: Optional[np.ndarray] = None) -> Optional[str]:
+        """Return a cached response for the context (and similar query), if any"""
+        now = time.time()
+        with self._lock:
+            hit_id = None
+            best_score = float("-inf")
+            for entry_id, (cached_emb, cached_hash, _, created_at) in list(self._entries.items()):
+                if now - created_at > self.ttl_seconds:
+                    del self._entries[entry_id]
+                    continue
+                if cached_hash != context_hash or (embedding is None) != (cached_emb is None):
+                    continue
+                if embedding is None:
+                    # Exact-key entries: any match will do
+                    hit_id = entry_id
+                    continue
+                # Embeddings are L2-normalized, so the dot product is the cosine similarity
+                score = float(np.dot(embedding, cached_emb))
+                if score >= self.similarity_threshold and score > best_score:
+                    hit_id, best_score = entry_id, score
+
+            if hit_id is None:
+                return None
+            self._entries.move_to_end(hit_id)
+            return self._entries[hit_id][2]
+
+    def store(self, context_hash: str, response: str, embedding: Optional[np.ndarray] = None):
+        """Cache a response, evicting the least recently used entries past capacity"""
+        if embedding is not None:
+            embedding = np.asarray(embedding, dtype=np.float32)
+        created_at = time.time()
+
+        with self._lock:
+            self._entries[self._next_id] = (embedding, context_hash, response, created_at)
+            self._next_id += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+            if self._conn is not None:
+                try:
+                    self._conn.execute(
+                        "INSERT INTO llm_cache (namespace, context_hash, embedding, response, created_at) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        (
+                            self.namespace,
+                            context_hash,
+                            embedding.tobytes() if embedding is not None else None,
+                            response,
+                            created_at
+                        )
+                    )
+                    # Apply the same TTL and capacity limits on disk
+                    self._conn.execute(
+                        "DELETE FROM llm_cache WHERE created_at < ?",
+                        (created_at - self.ttl_seconds,)
+                    )
+                    self._conn.execute(
+                        "DELETE FROM llm_cache WHERE namespace = ? AND rowid NOT IN ("
+                        "SELECT rowid FROM llm_cache WHERE namespace = ? "
+                        "ORDER BY created_at DESC LIMIT ?)",
+                        (self.namespace, self.namespace, self.max_entries)
+                    )
+                    self._conn.commit()
+                except sqlite3.Error as e:
+                    self._conn.rollback()
+                    logger.error(f"Error persisting semantic cache entry: {e}")
@@ -1,15 +1,18 @@
-from fastapi import FastAPI, APIRouter, UploadFile, File, HTTPException
+from fastapi import FastAPI, APIRouter, UploadFile, File, HTTPException, Request, Response
 from fastapi.responses import JSONResponse
+from cachetools import TTLCache
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
+import asyncio
 import logging
 from pathlib import Path
 from pydantic import BaseModel
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 import tempfile
-import shutil
+import hashlib
+from contextlib import asynccontextmanager
 
 # Import custom services
 from rag_service import RAGService
@@ -23,12 +26,45 @@ mongo_url = os.environ['MONGO_URL']
 client = AsyncIOMotorClient(mongo_url)
 db = client[os.environ['DB_NAME']]
 
-# Initialize RAG and Agent systems
-rag_service = RAGService()
-agent_system = MultiAgentQuestionSystem()
+# Read size for streaming uploaded files to disk
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+# Generated question responses keyed by ETag (query + collection revision + retrieval params)
+QUESTION_CACHE_TTL_SECONDS = 3600
+question_response_cache = TTLCache(maxsize=512, ttl=QUESTION_CACHE_TTL_SECONDS)
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Check an If-None-Match header (list, weak W/ tags or *) against an ETag"""
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in (tag[2:] if tag.startswith("W/") else tag for tag in tags)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Load the RAG and agent systems after startup instead of at import time"""
+    rag_service, agent_system = await asyncio.gather(
+        asyncio.to_thread(RAGService),
+        asyncio.to_thread(MultiAgentQuestionSystem)
+    )
+    # The agent's semantic cache embeds queries with the RAG embedding model
+    agent_system.embeddings = rag_service.embeddings
+    
+    # Pre-warm the embedding model so the first request doesn't pay tokenizer/session load
+    await asyncio.to_thread(rag_service.embeddings.embed_query, "warmup")
+    
+    app.state.rag_service = rag_service
+    app.state.agent_system = agent_system
+    logging.info("RAG and agent systems initialized")
+    
+    try:
+        yield
+    finally:
+        rag_service.close()
+        client.close()
 
 # Create the main app
-app = FastAPI(title="RAG-Based Question Generation API")
+app = FastAPI(title="RAG-Based Question Generation API", lifespan=lifespan)
 
 # Create router with /api prefix
 api_router = APIRouter(prefix="/api")
@@ -43,6 +79,7 @@ class IngestResponse(BaseModel):
 class QuestionGenerationRequest(BaseModel):
     query: str
     num_retrieved_docs: int = 5
+    filename: Optional[str] = None
 
 class QuestionResponse(BaseModel):
     query: str
@@ -62,7 +99,7 @@ async def root():
     }
 
 @api_router.post("/ingest", response_model=IngestResponse)
-async def ingest_pdf(file: UploadFile = File(...)):
+async def ingest_pdf(http_request: Request, file: UploadFile = File(...)):
     """
     Endpoint to upload and process a PDF file.
     Returns the Table of Contents for the uploaded document.
@@ -72,14 +109,17 @@ async def ingest_pdf(file: UploadFile = File(...)):
         if not file.filename.endswith('.pdf'):
             raise HTTPException(status_code=400, detail="Only PDF files are supported")
         
-        # Save uploaded file to temporary location
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
-            shutil.copyfileobj(file.file, tmp_file)
+        # Stream uploaded file to a temporary location in 1MB chunks
+        await file.seek(0)
+        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf', buffering=UPLOAD_CHUNK_SIZE) as tmp_file:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                tmp_file.write(chunk)
             tmp_path = tmp_file.name
         
         try:
-            # Ingest PDF
-            result = rag_service.ingest_pdf(
+            # Ingest PDF off the event loop (extraction + embedding are blocking)
+            result = await asyncio.to_thread(
+                http_request.app.state.rag_service.ingest_pdf,
                 pdf_path=tmp_path,
                 metadata={"filename": file.filename}
             )
@@ -104,17 +144,37 @@ async def ingest_pdf(file: UploadFile = File(...)):
         raise HTTPException(status_code=500, detail=f"Error processing PDF: {str(e)}")
 
 @api_router.post("/generate/questions", response_model=QuestionResponse)
-async def generate_questions(request: QuestionGenerationRequest):
+async def generate_questions(request: QuestionGenerationRequest, http_request: Request):
     """
     Endpoint to generate MCQ questions based on a text query.
     The system retrieves relevant documents and uses multi-agent workflow
     to generate, evaluate, and return high-quality questions.
+    Identical requests against an unchanged collection are served from cache
+    (or 304 Not Modified when the client sends a matching If-None-Match).
     """
     try:
-        # Retrieve relevant documents
-        retrieved_docs = rag_service.retrieve_relevant_docs(
+        rag_service = http_request.app.state.rag_service
+        revision = await asyncio.to_thread(lambda: rag_service.collection_revision)
+        etag = hashlib.sha256(
+            f"{request.query}|{revision}|{request.num_retrieved_docs}|{request.filename}".encode()
+        ).hexdigest()
+        cache_headers = {
+            "ETag": f'"{etag}"',
+            "Cache-Control": f"private, max-age={QUESTION_CACHE_TTL_SECONDS}"
+        }
+        
+        cached = question_response_cache.get(etag)
+        if cached is not None:
+            if etag_matches(http_request.headers.get("if-none-match"), cache_headers["ETag"]):
+                return Response(status_code=304, headers=cache_headers)
+            return JSONResponse(content=cached, headers=cache_headers)
+        
+        # Retrieve relevant documents (query embedding + Chroma search are blocking)
+        retrieved_docs = await asyncio.to_thread(
+            rag_service.retrieve_relevant_docs,
             query=request.query,
-            k=request.num_retrieved_docs
+            k=request.num_retrieved_docs,
+            filename=request.filename
         )
         
         if not retrieved_docs:
@@ -124,7 +184,7 @@ async def generate_questions(request: QuestionGenerationRequest):
             )
         
         # Generate questions using multi-agent system
-        questions = agent_system.generate_questions(
+        questions = await http_request.app.state.agent_system.generate_questions(
             query=request.query,
             retrieved_docs=retrieved_docs
         )
@@ -135,8 +195,13 @@ async def generate_questions(request: QuestionGenerationRequest):
             num_questions=len(questions)
         )
         
+        content = response.model_dump()
+        # Empty results usually mean a transient LLM failure; don't pin them for the cache TTL
+        if questions:
+            question_response_cache[etag] = content
+        
         logging.info(f"Generated {len(questions)} questions for query: {request.query}")
-        return response
+        return JSONResponse(content=content, headers=cache_headers if questions else None)
         
     except HTTPException:
         raise
@@ -168,10 +233,15 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
-
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8001)
+    # Single worker by default: the embedded Chroma store is not safe to write from several
+    # processes. WEB_CONCURRENCY > 1 is only for read-heavy use or a client/server Chroma.
+    uvicorn.run(
+        "server:app",
+        host="0.0.0.0",
+        port=8001,
+        workers=int(os.getenv('WEB_CONCURRENCY', '1')),
+        loop="uvloop",
+        http="httptools"
+    )
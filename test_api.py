@@ -1,29 +1,30 @@
 #!/usr/bin/env python3
 """Test script for RAG-based Question Generation API"""
-import requests
+import asyncio
+import httpx
 import json
 import os
 from pathlib import Path
 
 BASE_URL = "http://localhost:8001/api"
 
-def test_health_check():
+async def test_health_check(client: httpx.AsyncClient):
     """Test health check endpoint"""
     print("\n=== Testing Health Check ===")
-    response = requests.get(f"{BASE_URL}/health")
+    response = await client.get("/health")
     print(f"Status Code: {response.status_code}")
     print(f"Response: {response.json()}")
     return response.status_code == 200
 
-def test_root():
+async def test_root(client: httpx.AsyncClient):
     """Test root endpoint"""
     print("\n=== Testing Root Endpoint ===")
-    response = requests.get(f"{BASE_URL}/")
+    response = await client.get("/")
     print(f"Status Code: {response.status_code}")
     print(f"Response: {json.dumps(response.json(), indent=2)}")
     return response.status_code == 200
 
-def test_ingest_pdf(pdf_path: str):
+async def test_ingest_pdf(client: httpx.AsyncClient, pdf_path: str):
     """Test PDF ingestion endpoint"""
     print("\n=== Testing PDF Ingestion ===")
     
@@ -33,7 +34,7 @@ def test_ingest_pdf(pdf_path: str):
     
     with open(pdf_path, 'rb') as f:
         files = {'file': (os.path.basename(pdf_path), f, 'application/pdf')}
-        response = requests.post(f"{BASE_URL}/ingest", files=files)
+        response = await client.post("/ingest", files=files)
     
     print(f"Status Code: {response.status_code}")
     if response.status_code == 200:
@@ -51,22 +52,18 @@ def test_ingest_pdf(pdf_path: str):
         print(f"Error: {response.text}")
         return False
 
-def test_generate_questions(query: str):
+async def test_generate_questions(client: httpx.AsyncClient, query: str):
     """Test question generation endpoint"""
-    print(f"\n=== Testing Question Generation ===")
-    print(f"Query: {query}")
-    
     payload = {
         "query": query,
         "num_retrieved_docs": 5
     }
     
-    response = requests.post(
-        f"{BASE_URL}/generate/questions",
-        json=payload,
-        headers={'Content-Type': 'application/json'}
-    )
+    response = await client.post("/generate/questions", json=payload)
     
+    # Print after the response arrives so concurrent runs don't interleave their output
+    print(f"\n=== Testing Question Generation ===")
+    print(f"Query: {query}")
     print(f"Status Code: {response.status_code}")
     
     if response.status_code == 200:
@@ -91,7 +88,7 @@ def test_generate_questions(query: str):
         print(f"Error: {response.text}")
         return False
 
-def save_sample_questions(query: str, output_file: str = "sample_questions.json"):
+async def save_sample_questions(client: httpx.AsyncClient, query: str, output_file: str = "sample_questions.json"):
     """Generate and save sample questions to a file"""
     print(f"\n=== Saving Sample Questions to {output_file} ===")
     
@@ -100,11 +97,7 @@ def save_sample_questions(query: str, output_file: str = "sample_questions.json"
         "num_retrieved_docs": 5
     }
     
-    response = requests.post(
-        f"{BASE_URL}/generate/questions",
-        json=payload,
-        headers={'Content-Type': 'application/json'}
-    )
+    response = await client.post("/generate/questions", json=payload)
     
     if response.status_code == 200:
         with open(output_file, 'w') as f:
@@ -115,52 +108,56 @@ def save_sample_questions(query: str, output_file: str = "sample_questions.json"
         print(f"Error generating questions: {response.text}")
         return False
 
-def main():
+async def main():
     """Run all tests"""
     print("="*60)
     print("RAG-Based Question Generation System - API Tests")
     print("="*60)
     
-    # Test 1: Health check
-    if not test_health_check():
-        print("❌ Health check failed")
-        return
-    print("✅ Health check passed")
-    
-    # Test 2: Root endpoint
-    if not test_root():
-        print("❌ Root endpoint failed")
-        return
-    print("✅ Root endpoint passed")
-    
-    # Test 3: Ingest PDF
-    # Update this path to your PDF file
-    pdf_path = "A_Quick_Algebra_Review.pdf"
-    if not test_ingest_pdf(pdf_path):
-        print("❌ PDF ingestion failed")
-        print("\nNote: Make sure the PDF file exists and the path is correct.")
-        return
-    print("✅ PDF ingestion passed")
-    
-    # Test 4: Generate questions - Test different queries
-    test_queries = [
-        "linear equations and solving methods",
-        "quadratic equations",
-        "algebra fundamentals"
-    ]
-    
-    for query in test_queries:
-        if not test_generate_questions(query):
-            print(f"❌ Question generation failed for query: {query}")
-        else:
-            print(f"✅ Question generation passed for query: {query}")
-    
-    # Save sample questions
-    save_sample_questions(test_queries[0])
+    # One client for the whole run so the keep-alive connection is reused
+    async with httpx.AsyncClient(base_url=BASE_URL, timeout=120) as client:
+        # Test 1: Health check
+        if not await test_health_check(client):
+            print("❌ Health check failed")
+            return
+        print("✅ Health check passed")
+        
+        # Test 2: Root endpoint
+        if not await test_root(client):
+            print("❌ Root endpoint failed")
+            return
+        print("✅ Root endpoint passed")
+        
+        # Test 3: Ingest PDF
+        # Update this path to your PDF file
+        pdf_path = "A_Quick_Algebra_Review.pdf"
+        if not await test_ingest_pdf(client, pdf_path):
+            print("❌ PDF ingestion failed")
+            print("\nNote: Make sure the PDF file exists and the path is correct.")
+            return
+        print("✅ PDF ingestion passed")
+        
+        # Test 4: Generate questions - Test different queries
+        test_queries = [
+            "linear equations and solving methods",
+            "quadratic equations",
+            "algebra fundamentals"
+        ]
+        
+        # Run the generation requests concurrently
+        results = await asyncio.gather(*(test_generate_questions(client, q) for q in test_queries))
+        for query, passed in zip(test_queries, results):
+            if not passed:
+                print(f"❌ Question generation failed for query: {query}")
+            else:
+                print(f"✅ Question generation passed for query: {query}")
+        
+        # Save sample questions
+        await save_sample_questions(client, test_queries[0])
     
     print("\n" + "="*60)
     print("All tests completed!")
     print("="*60)
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())